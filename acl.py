@@ -0,0 +1,164 @@
+import threading
+
+ALL_DAYS = 0b1111111  # bit n set = allowed on weekday n (Monday = 0)
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_time(value):
+    """Convert 'HH:MM' into minutes since midnight"""
+    try:
+        hours, minutes = (int(part) for part in str(value).split(':'))
+    except ValueError:
+        raise ValueError(f"invalid time '{value}', expected HH:MM")
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > MINUTES_PER_DAY:
+        raise ValueError(f"invalid time '{value}', expected HH:MM")
+    return hours * 60 + minutes
+
+
+def format_time(minutes):
+    return None if minutes is None else f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def days_mask(days):
+    """Convert a list of weekday numbers (Monday = 0) into a bitmask"""
+    if days is None:
+        return ALL_DAYS
+    if not isinstance(days, list):
+        raise ValueError('days must be a list of weekday numbers')
+    mask = 0
+    for day in days:
+        if not isinstance(day, int) or isinstance(day, bool) or not 0 <= day <= 6:
+            raise ValueError('days must be weekday numbers 0 (Monday) to 6 (Sunday)')
+        mask |= 1 << day
+    return mask
+
+
+def in_window(window, weekday, minute):
+    days, start, end = window
+    if start <= end:
+        return bool(days & (1 << weekday)) and start <= minute < end
+    # Window wraps past midnight, e.g. 22:00-06:00: the early-morning part
+    # belongs to the window that started on the previous day
+    if minute >= start:
+        return bool(days & (1 << weekday))
+    return minute < end and bool(days & (1 << ((weekday - 1) % 7)))
+
+
+class Bitset:
+    """Fixed-cost membership test for small integer ids"""
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, value):
+        index = value >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index - len(self.bits) + 1))
+        self.bits[index] |= 1 << (value & 7)
+
+    def discard(self, value):
+        index = value >> 3
+        if index < len(self.bits):
+            self.bits[index] &= ~(1 << (value & 7)) & 0xFF
+
+    def __contains__(self, value):
+        index = value >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (value & 7)))
+
+
+class AccessIndex:
+    """In-memory copy of the door ACL tables, so unlocks need no DB queries.
+
+    Per door, users with an unrestricted grant are kept in a bitset of user
+    ids; time-limited grants are kept as (days, start, end) window lists.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.user_ids = {}
+        self.admin_ids = set()
+        self.doors = {}
+
+    def load(self, conn):
+        """Rebuild the whole index"""
+        user_ids = {}
+        admin_ids = set()
+        for row in conn.execute('SELECT id, username, role FROM users WHERE disabled = 0'):
+            user_ids[row['username']] = row['id']
+            if row['role'] == 'admin':
+                admin_ids.add(row['id'])
+
+        doors = {}
+        for row in conn.execute('SELECT id, name, relay_pin FROM doors'):
+            doors[row['id']] = self._new_door(row)
+        for row in conn.execute('SELECT user_id, door_id, days, start_minute, end_minute FROM door_permissions'):
+            door = doors.get(row['door_id'])
+            if door is not None:
+                self._add_permission(door, row)
+
+        with self.lock:
+            self.user_ids = user_ids
+            self.admin_ids = admin_ids
+            self.doors = doors
+
+    def refresh_door(self, conn, door_id):
+        """Reload one door's definition, keeping its permissions"""
+        row = conn.execute('SELECT id, name, relay_pin FROM doors WHERE id = ?', (door_id,)).fetchone()
+        with self.lock:
+            if row is None:
+                self.doors.pop(door_id, None)
+            elif door_id in self.doors:
+                self.doors[door_id]['name'] = row['name']
+                self.doors[door_id]['relay_pin'] = row['relay_pin']
+            else:
+                self.doors[door_id] = self._new_door(row)
+
+    def refresh_permissions(self, conn, user_id, door_id):
+        """Reload one user's grants on one door after a change"""
+        rows = conn.execute('''
+            SELECT user_id, door_id, days, start_minute, end_minute FROM door_permissions
+            WHERE user_id = ? AND door_id = ?
+        ''', (user_id, door_id)).fetchall()
+        with self.lock:
+            door = self.doors.get(door_id)
+            if door is None:
+                return
+            door['all_day'].discard(user_id)
+            door['windows'].pop(user_id, None)
+            for row in rows:
+                self._add_permission(door, row)
+
+    def get_door(self, door_id):
+        return self.doors.get(door_id)
+
+    def authorize(self, username, door_id, now):
+        """Return (allowed, reason) for username opening door_id at datetime now"""
+        door = self.doors.get(door_id)
+        if door is None:
+            return False, 'Unknown door'
+        user_id = self.user_ids.get(username)
+        if user_id is None:
+            return False, 'Unknown or disabled user'
+        if user_id in self.admin_ids or user_id in door['all_day']:
+            return True, None
+
+        weekday = now.weekday()
+        minute = now.hour * 60 + now.minute
+        for window in door['windows'].get(user_id, ()):
+            if in_window(window, weekday, minute):
+                return True, None
+        return False, 'No access to this door at this time'
+
+    @staticmethod
+    def _new_door(row):
+        return {'name': row['name'], 'relay_pin': row['relay_pin'], 'all_day': Bitset(), 'windows': {}}
+
+    @staticmethod
+    def _add_permission(door, row):
+        days = row['days']
+        start, end = row['start_minute'], row['end_minute']
+        if days == ALL_DAYS and start is None and end is None:
+            door['all_day'].add(row['user_id'])
+        else:
+            window = (days, start or 0, MINUTES_PER_DAY if end is None else end)
+            door['windows'].setdefault(row['user_id'], []).append(window)
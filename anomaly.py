@@ -0,0 +1,261 @@
+import json
+import threading
+
+import numpy as np
+
+# Access-history anomaly detection, run over columnar chunks of access_logs
+CHUNK_SIZE = 50000
+MAX_FLAGGED_EVENTS = 500      # most recent events returned by flagged_events()
+MAX_STORED_EVENTS = 10000     # older flagged events are pruned from the database
+MAX_SAVE_ATTEMPTS = 5
+
+# Odd-hour unlocks: an unlock is flagged when the user has enough history
+# and that hour of day accounts for less than RARE_HOUR_FRACTION of it
+MIN_UNLOCK_HISTORY = 20
+RARE_HOUR_FRACTION = 0.02
+
+# Failed-login bursts: flagged when, within FAILURE_WINDOW_SECONDS, a user
+# has at least MIN_FAILURES failed logins making up FAILURE_RATE_THRESHOLD
+# of their attempts
+FAILURE_WINDOW_SECONDS = 300
+MIN_FAILURES = 5
+FAILURE_RATE_THRESHOLD = 0.8
+
+
+def prior_counts(keys):
+    """For each element, how many earlier elements share its key"""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    positions = np.arange(len(keys))
+    group_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    first_in_group = np.maximum.accumulate(np.where(group_start, positions, 0))
+    counts = np.empty(len(keys), dtype=np.int64)
+    counts[order] = positions - first_in_group
+    return counts
+
+
+def flagged_events(conn, since_id=0, limit=MAX_FLAGGED_EVENTS):
+    """Most recent flagged events after access_logs id since_id, oldest first"""
+    rows = conn.execute('''
+        SELECT log_id, username, access_time, type, detail FROM access_anomalies
+        WHERE log_id > ? ORDER BY log_id DESC, type LIMIT ?
+    ''', (since_id, limit)).fetchall()
+    return [{
+        'id': log_id,
+        'username': username,
+        'access_time': access_time,
+        'type': kind,
+        'detail': json.loads(detail)
+    } for log_id, username, access_time, kind, detail in reversed(rows)]
+
+
+def status(conn):
+    last_id, rows_processed, usernames = conn.execute(
+        'SELECT last_id, rows_processed, usernames FROM anomaly_state WHERE id = 1'
+    ).fetchone()
+    return {
+        'last_id': last_id,
+        'rows_processed': rows_processed,
+        'users_profiled': len(json.loads(usernames)),
+        'flagged_total': conn.execute('SELECT COUNT(*) FROM access_anomalies').fetchone()[0]
+    }
+
+
+class AnomalyDetector:
+    """Processes rows added since the last run, by any process.
+
+    Per-user profiles and flagged events live in SQLite. A run loads the
+    shared state, scans without holding a database lock, and saves only if
+    no other process saved in the meantime; otherwise it starts over from
+    the newer state.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.last_id = 0
+        self.user_codes = {}
+        self.usernames = []
+        self.hour_counts = np.zeros((0, 24), dtype=np.int64)
+        # login attempts still inside the sliding window: timestamps, user codes, failed flags
+        self.recent_logins = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, bool))
+        self.rows_processed = 0
+
+    def run(self, conn, full=False):
+        """Process rows added since the last run (or everything if full),
+        returning the newly flagged events"""
+        with self.lock:
+            for _ in range(MAX_SAVE_ATTEMPTS):
+                generation = self._load(conn)
+                if full:
+                    self.reset()
+                new_events = self._scan(conn)
+                if self._save(conn, generation, new_events, full):
+                    return new_events
+            raise RuntimeError('anomaly state kept changing during the scan, try again')
+
+    def _load(self, conn):
+        """Replace this detector's state with the shared one, returning its generation"""
+        (generation, self.last_id, self.rows_processed, usernames,
+         hour_counts, recent_timestamps, recent_users, recent_failed) = conn.execute('''
+            SELECT generation, last_id, rows_processed, usernames,
+                   hour_counts, recent_timestamps, recent_users, recent_failed
+            FROM anomaly_state WHERE id = 1
+        ''').fetchone()
+        self.usernames = json.loads(usernames)
+        self.user_codes = {username: code for code, username in enumerate(self.usernames)}
+        self.hour_counts = np.zeros((0, 24), dtype=np.int64)
+        self.recent_logins = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, bool))
+        if hour_counts is not None:
+            self.hour_counts = np.frombuffer(hour_counts, dtype=np.int64).reshape(-1, 24).copy()
+        if recent_timestamps is not None:
+            self.recent_logins = (
+                np.frombuffer(recent_timestamps, dtype=np.int64).copy(),
+                np.frombuffer(recent_users, dtype=np.int64).copy(),
+                np.frombuffer(recent_failed, dtype=bool).copy()
+            )
+        return generation
+
+    def _save(self, conn, generation, new_events, full):
+        """Store state and events unless another run saved since _load"""
+        recent_timestamps, recent_users, recent_failed = self.recent_logins
+        with conn:
+            saved = conn.execute('''
+                UPDATE anomaly_state SET generation = generation + 1, last_id = ?, rows_processed = ?,
+                    usernames = ?, hour_counts = ?, recent_timestamps = ?, recent_users = ?, recent_failed = ?
+                WHERE id = 1 AND generation = ?
+            ''', (
+                self.last_id, self.rows_processed, json.dumps(self.usernames), self.hour_counts.tobytes(),
+                recent_timestamps.tobytes(), recent_users.tobytes(), recent_failed.tobytes(), generation
+            )).rowcount
+            if not saved:
+                return False
+            if full:
+                conn.execute('DELETE FROM access_anomalies')
+            conn.executemany('''
+                INSERT OR REPLACE INTO access_anomalies (log_id, type, username, access_time, detail)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(event['id'], event['type'], event['username'], event['access_time'], json.dumps(event['detail']))
+                  for event in new_events])
+            conn.execute('''
+                DELETE FROM access_anomalies WHERE log_id < (
+                    SELECT log_id FROM access_anomalies ORDER BY log_id DESC LIMIT 1 OFFSET ?
+                )
+            ''', (MAX_STORED_EVENTS - 1,))
+        return True
+
+    def _scan(self, conn):
+        new_events = []
+        while True:
+            rows = conn.execute('''
+                SELECT id, username, access_time,
+                       CAST(strftime('%s', access_time) AS INTEGER),
+                       CAST(strftime('%H', access_time, 'localtime') AS INTEGER),
+                       status, action
+                FROM access_logs WHERE id > ? AND access_time IS NOT NULL
+                ORDER BY id LIMIT ?
+            ''', (self.last_id, CHUNK_SIZE)).fetchall()
+            if not rows:
+                break
+            new_events.extend(self._process_chunk(rows))
+            self.last_id = rows[-1][0]
+            self.rows_processed += len(rows)
+        return new_events
+
+    def _encode_users(self, usernames):
+        codes = np.empty(len(usernames), dtype=np.int64)
+        for i, username in enumerate(usernames):
+            code = self.user_codes.get(username)
+            if code is None:
+                code = self.user_codes[username] = len(self.usernames)
+                self.usernames.append(username)
+            codes[i] = code
+        if len(self.usernames) > len(self.hour_counts):
+            grown = np.zeros((len(self.usernames), 24), dtype=np.int64)
+            grown[:len(self.hour_counts)] = self.hour_counts
+            self.hour_counts = grown
+        return codes
+
+    def _process_chunk(self, rows):
+        ids, usernames, access_times, timestamps, hours, statuses, actions = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        timestamps = np.array(timestamps, dtype=np.int64)
+        hours = np.array(hours, dtype=np.int64)
+        failed = np.array(statuses) == 'failed'
+        actions = np.array(actions, dtype=object)
+        users = self._encode_users(usernames)
+
+        flagged = []
+        flagged.extend(self._odd_hour_unlocks(ids, users, hours, failed, actions))
+        flagged.extend(self._failed_login_bursts(ids, users, timestamps, failed, actions))
+
+        events = []
+        for index, kind, detail in flagged:
+            events.append({
+                'id': int(ids[index]),
+                'username': usernames[index],
+                'access_time': access_times[index],
+                'type': kind,
+                'detail': detail
+            })
+        events.sort(key=lambda event: event['id'])
+        return events
+
+    def _odd_hour_unlocks(self, ids, users, hours, failed, actions):
+        unlocks = (actions == 'Unlocked') & ~failed
+        unlock_users = users[unlocks]
+        unlock_hours = hours[unlocks]
+        # Score each unlock only against the unlocks before it (rows are in
+        # id order): earlier chunks plus earlier rows of this chunk. This
+        # keeps full and incremental runs in agreement.
+        totals = self.hour_counts.sum(axis=1)[unlock_users] + prior_counts(unlock_users)
+        in_hour = (self.hour_counts[unlock_users, unlock_hours]
+                   + prior_counts(unlock_users * 24 + unlock_hours))
+        hour_share = in_hour / np.maximum(totals, 1)
+        odd = (totals >= MIN_UNLOCK_HISTORY) & (hour_share < RARE_HOUR_FRACTION)
+        np.add.at(self.hour_counts, (unlock_users, unlock_hours), 1)
+
+        positions = np.flatnonzero(unlocks)[odd]
+        return [
+            (index, 'odd_hour_unlock', {'hour': int(hours[index]), 'hour_share': round(float(share), 4)})
+            for index, share in zip(positions, hour_share[odd])
+        ]
+
+    def _failed_login_bursts(self, ids, users, timestamps, failed, actions):
+        logins = actions == 'Login'
+        carried_ts, carried_users, carried_failed = self.recent_logins
+        carried = len(carried_ts)
+        login_ts = np.concatenate([carried_ts, timestamps[logins]])
+        login_users = np.concatenate([carried_users, users[logins]])
+        login_failed = np.concatenate([carried_failed, failed[logins]])
+        positions = np.concatenate([np.full(carried, -1), np.flatnonzero(logins)])
+
+        if len(login_ts):
+            # Sort by (user, time) and offset each user's timeline so that a
+            # single searchsorted finds every row's window start
+            order = np.lexsort((login_ts, login_users))
+            span = int(login_ts.max() - login_ts.min()) + FAILURE_WINDOW_SECONDS + 1
+            keys = login_users[order] * span + (login_ts[order] - login_ts.min())
+            window_start = np.searchsorted(keys, keys - FAILURE_WINDOW_SECONDS, side='right')
+            attempts = np.arange(1, len(keys) + 1) - window_start
+            failed_cumulative = np.concatenate([[0], np.cumsum(login_failed[order])])
+            failures = failed_cumulative[1:] - failed_cumulative[window_start]
+            rates = failures / attempts
+
+            burst = (login_failed[order] & (failures >= MIN_FAILURES)
+                     & (rates >= FAILURE_RATE_THRESHOLD) & (positions[order] >= 0))
+            flagged = [
+                (int(index), 'failed_login_burst', {
+                    'failures': int(count),
+                    'failure_rate': round(float(rate), 4),
+                    'window_seconds': FAILURE_WINDOW_SECONDS
+                })
+                for index, count, rate in zip(positions[order][burst], failures[burst], rates[burst])
+            ]
+
+            keep = login_ts > login_ts.max() - FAILURE_WINDOW_SECONDS
+            self.recent_logins = (login_ts[keep], login_users[keep], login_failed[keep])
+            return flagged
+        return []
@@ -4,14 +4,47 @@ import sqlite3
 import datetime
 import time
 import socket
+import os
 import requests
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+import acl
+import anomaly
+import database
+import profiling
+import response_cache
+import retention
+import user_import
 
 app = Flask(__name__)
 CORS(app)
 
 # Database configuration
-DATABASE = 'smart_door_lock.db'
+DATABASE = database.DATABASE
 app.esp_commands = {}
+app.user_roles = None
+app.user_roles_version = None
+app.data_versions = {}
+app.acl_index = None
+app.acl_index_version = None
+app.anomaly_detector = anomaly.AnomalyDetector()
+profiling.init_profiling(
+    app, lambda: get_db_connection(), toggle_signal=os.environ.get('PROFILING_TOGGLE_SIGNAL')
+)
+
+def init_db():
+    """Bring the database schema up to date (no-op when already current)"""
+    database.init_database(DATABASE)
+
+# Every process serving the app (dev server or gunicorn worker) migrates on load
+init_db()
+
+# Login tokens are signed with SECRET_KEY, or the key stored in the database
+# so that every worker process accepts the same tokens
+TOKEN_MAX_AGE_SECONDS = 12 * 3600
+# How often in-memory user/ACL copies check the database for changes
+VERSION_CHECK_INTERVAL_SECONDS = 1.0
+# Bulk ACL changes touching more user/door pairs than this rebuild the index
+ACL_REFRESH_PAIR_LIMIT = 50
 
 def get_local_ip():
     """Get local IP address"""
@@ -32,49 +65,167 @@ def print_network_info():
     print("="*50)
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
+    conn = profiling.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
+def shared_data_version(name):
+    """Read a data_versions counter, at most once per VERSION_CHECK_INTERVAL_SECONDS"""
+    version, checked_at = app.data_versions.get(name, (None, 0.0))
+    now = time.monotonic()
+    if version is None or now - checked_at >= VERSION_CHECK_INTERVAL_SECONDS:
+        conn = get_db_connection()
+        version = database.get_data_version(conn, name)
+        conn.close()
+        app.data_versions[name] = (version, now)
+    return version
+
+def refresh_user_roles():
+    """Reload the in-memory username -> role map of active users"""
     conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS access_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            access_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            status TEXT NOT NULL,
-            action TEXT NOT NULL
-        )
-    ''')
-    
-    default_users = [
-        ('admin', 'admin123', 'admin'),
-        ('Himani', 'Himani123', 'user'),
-        ('user2', 'user123', 'user'),
-        ('user3', 'user123', 'user'),
-        ('user4', 'user123', 'user')
-    ]
-    
-    for username, password, role in default_users:
-        conn.execute(
-            'INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
-            (username, password, role)
-        )
+    version = database.get_data_version(conn, 'users')
+    rows = conn.execute('SELECT username, role FROM users WHERE disabled = 0').fetchall()
+    conn.close()
+    app.user_roles = {row['username']: row['role'] for row in rows}
+    app.user_roles_version = version
+    app.data_versions['users'] = (version, time.monotonic())
+    return app.user_roles
+
+def get_user_role(username):
+    # Another worker may have imported users; reload when the shared version moved
+    if app.user_roles is None or app.user_roles_version != shared_data_version('users'):
+        refresh_user_roles()
+    return app.user_roles.get(username)
+
+def token_serializer():
+    if app.secret_key is None:
+        conn = get_db_connection()
+        app.secret_key = os.environ.get('SECRET_KEY') or database.get_setting(conn, 'secret_key')
+        conn.close()
+    return URLSafeTimedSerializer(app.secret_key, salt='auth-token')
+
+def issue_token(user):
+    return token_serializer().dumps({'id': user['id'], 'username': user['username']})
+
+def authenticated_user():
+    """Return (username, role) for the request's bearer token, or (None, None)"""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None, None
+    try:
+        data = token_serializer().loads(header[len('Bearer '):], max_age=TOKEN_MAX_AGE_SECONDS)
+    except BadSignature:
+        return None, None
+    # Disabled or removed users lose access even with an unexpired token
+    role = get_user_role(data.get('username'))
+    if role is None:
+        return None, None
+    return data['username'], role
+
+def require_admin():
+    """Return (username, None) for an authenticated admin, else (None, error response)"""
+    username, role = authenticated_user()
+    if username is None:
+        return None, (jsonify({'success': False, 'error': 'Authentication required'}), 401)
+    if role != 'admin':
+        return None, (jsonify({'success': False, 'error': 'Admin access required'}), 403)
+    return username, None
+
+def refresh_acl_index():
+    """Rebuild the in-memory door access index from the database"""
+    index = acl.AccessIndex()
+    conn = get_db_connection()
+    version = (database.get_data_version(conn, 'users'), database.get_data_version(conn, 'acl'))
+    index.load(conn)
+    conn.close()
+    now = time.monotonic()
+    app.data_versions['users'] = (version[0], now)
+    app.data_versions['acl'] = (version[1], now)
+    app.acl_index = index
+    app.acl_index_version = version
+    return index
+
+def get_acl_index():
+    # Rebuild when another process changed users or ACLs; the versions are
+    # re-read at most once per VERSION_CHECK_INTERVAL_SECONDS
+    current_version = (shared_data_version('users'), shared_data_version('acl'))
+    if app.acl_index is None or app.acl_index_version != current_version:
+        return refresh_acl_index()
+    return app.acl_index
+
+def update_acl_index(previous_acl_version, apply):
+    """Apply a committed ACL write to this process's index incrementally.
+
+    If the index had already missed another process's write it is dropped
+    and rebuilt on next use instead.
+    """
+    index = app.acl_index
+    if index is None or app.acl_index_version[1] != previous_acl_version:
+        app.acl_index = None
+        return
+    apply(index)
+    app.acl_index_version = (app.acl_index_version[0], previous_acl_version + 1)
+    app.data_versions['acl'] = (previous_acl_version + 1, time.monotonic())
+
+def parse_door_id(value):
+    # bool is an int subclass and float would silently truncate
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('door_id must be an integer')
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('door_id must be an integer')
+
+def parse_acl_changes(conn, action, items):
+    """Validate a list of grant/revoke entries, returning
+    (user_id, username, door_id, days, start_minute, end_minute) tuples.
+
+    Raises ValueError for malformed entries and LookupError for unknown
+    users or doors; both messages name the offending entry.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('permissions must be a non-empty list')
+    names = list({item.get('user') for item in items
+                  if isinstance(item, dict) and isinstance(item.get('user'), str)})
+    user_ids = {}
+    for start in range(0, len(names), 500):
+        batch = names[start:start + 500]
+        user_ids.update(conn.execute(
+            f"SELECT username, id FROM users WHERE username IN ({','.join('?' * len(batch))})",
+            batch
+        ).fetchall())
+    door_ids = {row[0] for row in conn.execute('SELECT id FROM doors')}
     
-    conn.commit()
+    changes = []
+    for position, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('entry must be an object')
+            if not isinstance(item.get('user'), str):
+                raise ValueError('user must be a username')
+            door_id = parse_door_id(item.get('door_id'))
+            if user_ids.get(item.get('user')) is None or door_id not in door_ids:
+                raise LookupError('Unknown user or door')
+            days = start_minute = end_minute = None
+            if action == 'grant':
+                days = acl.days_mask(item.get('days'))
+                start_minute = acl.parse_time(item['start_time']) if item.get('start_time') else None
+                end_minute = acl.parse_time(item['end_time']) if item.get('end_time') else None
+        except (ValueError, LookupError) as e:
+            raise type(e)(f"permissions[{position}]: {e}")
+        changes.append((user_ids[item['user']], item['user'], door_id, days, start_minute, end_minute))
+    return changes
+
+def access_logs_version():
+    """Version of access_logs shared by all processes: newest row id plus
+    a counter bumped when rows are removed (retention)"""
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT (SELECT MAX(id) FROM access_logs), "
+        "(SELECT version FROM data_versions WHERE name = 'access_logs')"
+    ).fetchone()
     conn.close()
-    print("✅ Database initialized successfully")
+    return tuple(row)
 
 def log_access(username, status, action):
     try:
@@ -111,6 +262,7 @@ def set_esp_command(command, relay_pin=None, duration=None):
     for cmd_id in expired_commands:
         del app.esp_commands[cmd_id]
     
+    response_cache.bump('esp_commands')
     return command_id
 
 # Test route
@@ -138,7 +290,7 @@ def login():
         
         conn = get_db_connection()
         user = conn.execute(
-            'SELECT * FROM users WHERE username = ? AND password = ?',
+            'SELECT * FROM users WHERE username = ? AND password = ? AND disabled = 0',
             (username, password)
         ).fetchone()
         conn.close()
@@ -148,6 +300,7 @@ def login():
             log_access(username, "success", "Login")
             return jsonify({
                 'success': True,
+                'token': issue_token(user),
                 'user': {
                     'id': user['id'],
                     'username': user['username'],
@@ -170,14 +323,30 @@ def login():
 @app.route('/api/unlock-door', methods=['POST'])
 def unlock_door():
     try:
-        data = request.get_json()
-        username = data.get('username')
-        is_admin = data.get('is_admin', False)
-        
-        print(f"🔓 Unlock door request from: {username} (admin: {is_admin})")
+        data = request.get_json(silent=True) or {}
+        username, role = authenticated_user()
+        if username is None:
+            return jsonify({"success": False, "error": "Authentication required"}), 401
+        try:
+            door_id = parse_door_id(data.get('door_id', 1))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        
+        print(f"🔓 Unlock door request from: {username} (role: {role}, door: {door_id})")
+        
+        # Authorization is answered from the in-memory ACL index
+        acl_index = get_acl_index()
+        if acl_index.get_door(door_id) is None:
+            return jsonify({"success": False, "error": "Unknown door"}), 404
+        allowed, reason = acl_index.authorize(username, door_id, datetime.datetime.now())
+        if not allowed:
+            print(f"⛔ Unlock denied for {username} on door {door_id}: {reason}")
+            log_access(username, "failed", "Unlock denied")
+            return jsonify({"success": False, "error": reason}), 403
+        relay_pin = acl_index.get_door(door_id)['relay_pin']
         
         # Set command for ESP8266 - activate relay for 10 seconds
-        command_id = set_esp_command("activate", relay_pin=1, duration=10000)
+        command_id = set_esp_command("activate", relay_pin=relay_pin, duration=10000)
         
         log_access(username, "success", "Unlocked")
         
@@ -185,7 +354,8 @@ def unlock_door():
             "success": True, 
             "message": "Unlock command sent to relay",
             "command_id": command_id,
-            "relay_pin": 1,
+            "door_id": door_id,
+            "relay_pin": relay_pin,
             "duration": 10000
         })
         
@@ -197,14 +367,23 @@ def unlock_door():
 @app.route('/api/lock-door', methods=['POST'])
 def lock_door():
     try:
-        data = request.get_json()
-        username = data.get('username')
-        is_admin = data.get('is_admin', False)
+        data = request.get_json(silent=True) or {}
+        username, role = authenticated_user()
+        if username is None:
+            return jsonify({"success": False, "error": "Authentication required"}), 401
+        try:
+            door_id = parse_door_id(data.get('door_id', 1))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        
+        print(f"🔒 Lock door request from: {username} (role: {role}, door: {door_id})")
         
-        print(f"🔒 Lock door request from: {username} (admin: {is_admin})")
+        door = get_acl_index().get_door(door_id)
+        if door is None:
+            return jsonify({"success": False, "error": "Unknown door"}), 404
         
         # Set command for ESP8266 - deactivate relay
-        command_id = set_esp_command("deactivate", relay_pin=1)
+        command_id = set_esp_command("deactivate", relay_pin=door['relay_pin'])
         
         log_access(username, "success", "Locked")
         
@@ -212,7 +391,8 @@ def lock_door():
             "success": True, 
             "message": "Lock command sent to relay",
             "command_id": command_id,
-            "relay_pin": 1
+            "door_id": door_id,
+            "relay_pin": door['relay_pin']
         })
         
     except Exception as e:
@@ -232,6 +412,7 @@ def get_esp_command():
             command_id = unexecuted_commands[0]
             command_data = app.esp_commands[command_id]
             command_data['executed'] = True
+            response_cache.bump('esp_commands')
             
             print(f"📡 Sending command to ESP8266: {command_data}")
             
@@ -262,6 +443,7 @@ def confirm_command():
             if success:
                 print(f"✅ ESP8266 executed command {command_id}: {message}")
                 del app.esp_commands[command_id]
+                response_cache.bump('esp_commands')
             else:
                 print(f"❌ ESP8266 failed command {command_id}: {message}")
         
@@ -276,36 +458,45 @@ def confirm_command():
 def esp_debug():
     """Check ESP8266 connection status"""
     try:
-        active_commands = []
-        recent_commands = []
-        
-        current_time = time.time()
-        for cmd_id, cmd in app.esp_commands.items():
-            if not cmd['executed'] and current_time - cmd['timestamp'] < 60:
-                active_commands.append(cmd_id)
-            
-            recent_commands.append({
-                'command_id': cmd_id,
-                'command': cmd['command'],
-                'relay_pin': cmd['relay_pin'],
-                'timestamp': cmd['timestamp'],
-                'executed': cmd['executed']
-            })
-        
-        recent_commands.sort(key=lambda x: x['timestamp'], reverse=True)
-        recent_commands = recent_commands[:5]
-        
-        return jsonify({
-            'success': True,
-            'pending_commands': len(app.esp_commands),
-            'active_commands': active_commands,
-            'recent_commands': recent_commands,
-            'total_commands_stored': len(app.esp_commands)
-        })
+        return response_cache.cached_response('esp_commands', build_esp_debug)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def build_esp_debug():
+    """Build the ESP8266 debug payload and the time it goes stale"""
+    active_commands = []
+    recent_commands = []
+    expires_at = None
+    
+    current_time = time.time()
+    for cmd_id, cmd in app.esp_commands.items():
+        if not cmd['executed'] and current_time - cmd['timestamp'] < 60:
+            active_commands.append(cmd_id)
+            # Command stops being active after 60 seconds
+            stale_at = cmd['timestamp'] + 60
+            if expires_at is None or stale_at < expires_at:
+                expires_at = stale_at
+        
+        recent_commands.append({
+            'command_id': cmd_id,
+            'command': cmd['command'],
+            'relay_pin': cmd['relay_pin'],
+            'timestamp': cmd['timestamp'],
+            'executed': cmd['executed']
+        })
+    
+    recent_commands.sort(key=lambda x: x['timestamp'], reverse=True)
+    recent_commands = recent_commands[:5]
+    
+    return {
+        'success': True,
+        'pending_commands': len(app.esp_commands),
+        'active_commands': active_commands,
+        'recent_commands': recent_commands,
+        'total_commands_stored': len(app.esp_commands)
+    }, expires_at
+
 # ESP8266 test command endpoint
 @app.route('/api/esp8266/test-command', methods=['POST'])
 def test_esp_command():
@@ -349,414 +540,312 @@ def esp_status():
 @app.route('/api/access-logs', methods=['GET'])
 def get_access_logs():
     try:
-        conn = get_db_connection()
-        logs = conn.execute('''
-            SELECT * FROM access_logs 
-            ORDER BY access_time DESC 
-            LIMIT 20
-        ''').fetchall()
-        conn.close()
-        
-        logs_list = [{
-            'id': log['id'],
-            'username': log['username'],
-            'access_time': log['access_time'],
-            'status': log['status'],
-            'action': log['action']
-        } for log in logs]
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+        include_archived = request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+        
+        def build_access_logs():
+            conn = get_db_connection()
+            logs = conn.execute('''
+                SELECT * FROM access_logs 
+                ORDER BY access_time DESC 
+                LIMIT ?
+            ''', (limit,)).fetchall()
+            conn.close()
+            
+            logs_list = [{
+                'id': log['id'],
+                'username': log['username'],
+                'access_time': log['access_time'],
+                'status': log['status'],
+                'action': log['action']
+            } for log in logs]
+            
+            # Fill up with archived rows, which are all older than live ones
+            if include_archived and len(logs_list) < limit:
+                logs_list.extend({
+                    'id': log['id'],
+                    'username': log['username'],
+                    'access_time': log['access_time'],
+                    'status': log['status'],
+                    'action': log.get('action'),
+                    'archived': True
+                } for log in retention.read_archived_logs(limit - len(logs_list)))
+            
+            return {'success': True, 'logs': logs_list}, None
         
-        return jsonify({'success': True, 'logs': logs_list})
+        return response_cache.cached_response(
+            'access_logs', build_access_logs,
+            key=(limit, include_archived), version=access_logs_version()
+        )
         
     except Exception as e:
         return jsonify({'success': False, 'error': 'Server error','exception':str(e)}), 500
 
-if __name__ == '_main_':
-    init_db()
-    print_network_info()
-    
-    print("\n🚀 Starting Smart Door Lock Server on port 5000...")
-    print("📡 Available endpoints:")
-    print("   GET  /api/test")
-    print("   GET  /api/esp8266/debug")
-    print("   GET  /api/esp8266/command")
-    print("   POST /api/esp8266/test-command")
-    print("   POST /api/esp8266/confirm")
-    print("   POST /api/esp8266/status")
-    print("   POST /api/login")
-    print("   POST /api/unlock-door")
-    print("   POST /api/lock-door")
-    print("   GET  /api/access-logs")
-    
-    app.run(host='0.0.0.0', port=5000, debug=True)
-import socket
-import requests
-
-app = Flask(__name__)
-CORS(app)
-
-# Database configuration
-DATABASE = 'smart_door_lock.db'
-app.esp_commands = {}
-
-def get_local_ip():
-    """Get local IP address"""
+# Profiling admin endpoint
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """Inspect or change runtime profiling settings"""
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.connect(("8.8.8.8", 80))
-            return s.getsockname()[0]
-    except:
-        return "127.0.0.1"
-
-def print_network_info():
-    local_ip = get_local_ip()
-    print("\n" + "="*50)
-    print("🌐 NETWORK INFORMATION")
-    print("="*50)
-    print(f"   Local IP:    {local_ip}")
-    print(f"   Server URL:  http://{local_ip}:5000")
-    print("="*50)
-
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS access_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            access_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            status TEXT NOT NULL,
-            action TEXT NOT NULL
-        )
-    ''')
-    
-    default_users = [
-        ('admin', 'admin123', 'admin'),
-        ('Himani', 'Himani123', 'user'),
-        ('user2', 'user123', 'user'),
-        ('user3', 'user123', 'user'),
-        ('user4', 'user123', 'user')
-    ]
-    
-    for username, password, role in default_users:
-        conn.execute(
-            'INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
-            (username, password, role)
-        )
-    
-    conn.commit()
-    conn.close()
-    print("✅ Database initialized successfully")
-
-def log_access(username, status, action):
-    try:
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO access_logs (username, status, action) VALUES (?, ?, ?)',
-            (username, status, action)
-        )
-        conn.commit()
-        conn.close()
-        print(f"📝 Access logged: {username} - {status} - {action}")
-    except Exception as e:
-        print(f"❌ Error logging access: {e}")
-
-def set_esp_command(command, relay_pin=None, duration=None):
-    """Set command for ESP8266 with relay control details"""
-    command_id = str(int(time.time()))
-    
-    if relay_pin is None:
-        relay_pin = 1
-    
-    app.esp_commands[command_id] = {
-        'command': command,
-        'relay_pin': relay_pin,
-        'duration': duration or 10000,
-        'timestamp': time.time(),
-        'executed': False
-    }
-    
-    # Clean up old commands (older than 5 minutes)
-    current_time = time.time()
-    expired_commands = [cmd_id for cmd_id, cmd in app.esp_commands.items() 
-                       if current_time - cmd['timestamp'] > 300]
-    for cmd_id in expired_commands:
-        del app.esp_commands[cmd_id]
-    
-    return command_id
-
-# Test route
-@app.route('/api/test', methods=['GET'])
-def test():
-    return jsonify({
-        'success': True,
-        'message': 'Backend is working!',
-        'server_ip': get_local_ip(),
-        'timestamp': datetime.datetime.now().isoformat()
-    })
-
-# Login route
-@app.route('/api/login', methods=['POST'])
-def login():
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'success': False, 'error': 'No JSON data received'}), 400
-            
-        username = data.get('username')
-        password = data.get('password')
+        admin, error = require_admin()
+        if error:
+            return error
         
-        print(f"🔐 Login attempt: {username}")
+        data = (request.get_json() or {}) if request.method == 'POST' else {}
+        if data:
+            error = profiling.update_settings(app, data)
+            if error:
+                return jsonify({'success': False, 'error': error}), 400
+            print(f"🩺 Profiling settings updated by {admin}: {app.profiling['settings']}")
         
-        conn = get_db_connection()
-        user = conn.execute(
-            'SELECT * FROM users WHERE username = ? AND password = ?',
-            (username, password)
-        ).fetchone()
-        conn.close()
+        return jsonify({'success': True, **profiling.summary(app)})
         
-        if user:
-            print(f"✅ Login successful: {username}")
-            log_access(username, "success", "Login")
-            return jsonify({
-                'success': True,
-                'user': {
-                    'id': user['id'],
-                    'username': user['username'],
-                    'role': user['role']
-                }
-            })
-        else:
-            print(f"❌ Login failed: {username}")
-            log_access(username, "failed", "Login")
-            return jsonify({
-                'success': False,
-                'error': 'Invalid username or password'
-            }), 401
-            
     except Exception as e:
-        print(f"❌ Login error: {e}")
-        return jsonify({'success': False, 'error': 'Server error'}), 500
+        print(f"❌ Profiling admin error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# Unlock door route
-@app.route('/api/unlock-door', methods=['POST'])
-def unlock_door():
+# Access-log retention admin endpoint
+@app.route('/api/admin/retention', methods=['POST'])
+def admin_retention():
+    """Archive expired access logs and reclaim database space"""
     try:
-        data = request.get_json()
-        username = data.get('username')
-        is_admin = data.get('is_admin', False)
+        admin, error = require_admin()
+        if error:
+            return error
         
-        print(f"🔓 Unlock door request from: {username} (admin: {is_admin})")
+        data = request.get_json() or {}
+        retention_days = data.get('retention_days', retention.RETENTION_DAYS)
+        if isinstance(retention_days, bool) or not isinstance(retention_days, int) or retention_days < 0:
+            return jsonify({'success': False, 'error': 'retention_days must be a non-negative integer'}), 400
         
-        # Set command for ESP8266 - activate relay for 10 seconds
-        command_id = set_esp_command("activate", relay_pin=1, duration=10000)
-        
-        log_access(username, "success", "Unlocked")
+        # Large backlogs take longer than a request may run, so archive in
+        # the background and report progress through the server log
+        if not retention.start_background_run(get_db_connection, retention_days):
+            return jsonify({'success': False, 'error': 'A retention run is already in progress'}), 409
         
-        return jsonify({
-            "success": True, 
-            "message": "Unlock command sent to relay",
-            "command_id": command_id,
-            "relay_pin": 1,
-            "duration": 10000
-        })
+        print(f"🗄️ Retention run started by {admin}")
+        return jsonify({'success': True, 'message': 'Retention run started'}), 202
         
     except Exception as e:
-        print(f"❌ Unlock door error: {e}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        print(f"❌ Retention error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# Lock door route
-@app.route('/api/lock-door', methods=['POST'])
-def lock_door():
+# Bulk user provisioning endpoint
+@app.route('/api/admin/users/import', methods=['POST'])
+def admin_import_users():
+    """Create, update or disable users from a JSON list or CSV upload"""
     try:
-        data = request.get_json()
-        username = data.get('username')
-        is_admin = data.get('is_admin', False)
-        
-        print(f"🔒 Lock door request from: {username} (admin: {is_admin})")
-        
-        # Set command for ESP8266 - deactivate relay
-        command_id = set_esp_command("deactivate", relay_pin=1)
+        admin, error = require_admin()
+        if error:
+            return error
+        
+        upload = request.files.get('file')
+        if upload or request.mimetype == 'text/csv':
+            # multipart upload with the CSV in 'file', or a text/csv body
+            try:
+                rows = user_import.parse_csv_rows(upload.stream if upload else request.stream)
+            except user_import.ImportFormatError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        else:
+            data = request.get_json(silent=True) or {}
+            users = data.get('users')
+            if not isinstance(users, list):
+                return jsonify({'success': False, 'error': 'users must be a list'}), 400
+            rows = user_import.parse_json_rows(users)
         
-        log_access(username, "success", "Locked")
+        conn = get_db_connection()
+        try:
+            summary = user_import.import_users(conn, rows)
+        finally:
+            conn.close()
+        refresh_user_roles()
+        refresh_acl_index()
         
-        return jsonify({
-            "success": True, 
-            "message": "Lock command sent to relay",
-            "command_id": command_id,
-            "relay_pin": 1
-        })
+        print(f"👥 User import by {admin}: {summary['created']} created, "
+              f"{summary['updated']} updated, {summary['failed']} failed")
+        return jsonify({'success': True, **summary})
         
     except Exception as e:
-        print(f"❌ Lock door error: {e}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        print(f"❌ User import error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# ESP8266 command polling endpoint
-@app.route('/api/esp8266/command', methods=['GET'])
-def get_esp_command():
+# Door management endpoint
+@app.route('/api/admin/doors', methods=['GET', 'POST'])
+def admin_doors():
+    """List doors, or create/update one"""
     try:
-        # Get the latest unexecuted command
-        current_time = time.time()
-        unexecuted_commands = [cmd_id for cmd_id, cmd in app.esp_commands.items() 
-                             if not cmd['executed'] and current_time - cmd['timestamp'] < 60]
+        admin, error = require_admin()
+        if error:
+            return error
         
-        if unexecuted_commands:
-            command_id = unexecuted_commands[0]
-            command_data = app.esp_commands[command_id]
-            command_data['executed'] = True
-            
-            print(f"📡 Sending command to ESP8266: {command_data}")
+        data = (request.get_json() or {}) if request.method == 'POST' else {}
+        
+        conn = get_db_connection()
+        try:
+            if request.method == 'POST':
+                name = data.get('name')
+                relay_pin = data.get('relay_pin')
+                if not name or not isinstance(relay_pin, int) or isinstance(relay_pin, bool):
+                    return jsonify({'success': False, 'error': 'name and integer relay_pin are required'}), 400
+                
+                with conn:
+                    acl_version = database.get_data_version(conn, 'acl')
+                    if data.get('door_id') is not None:
+                        try:
+                            door_id = parse_door_id(data['door_id'])
+                        except ValueError as e:
+                            return jsonify({'success': False, 'error': str(e)}), 400
+                        cursor = conn.execute(
+                            'UPDATE doors SET name = ?, relay_pin = ? WHERE id = ?',
+                            (name, relay_pin, door_id)
+                        )
+                        if cursor.rowcount == 0:
+                            return jsonify({'success': False, 'error': 'Unknown door'}), 404
+                    else:
+                        door_id = conn.execute(
+                            'INSERT INTO doors (name, relay_pin) VALUES (?, ?)',
+                            (name, relay_pin)
+                        ).lastrowid
+                    database.bump_data_version(conn, 'acl')
+                update_acl_index(acl_version, lambda index: index.refresh_door(conn, door_id))
+                print(f"🚪 Door {door_id} ({name}) saved by {admin}")
             
-            return jsonify({
-                'has_command': True,
-                'command_id': command_id,
-                'command': command_data['command'],
-                'relay_pin': command_data['relay_pin'],
-                'duration': command_data.get('duration', 0)
-            })
+            doors = [dict(row) for row in conn.execute('SELECT id, name, relay_pin FROM doors ORDER BY id')]
+        finally:
+            conn.close()
         
-        return jsonify({'has_command': False, 'command': 'none'})
+        return jsonify({'success': True, 'doors': doors})
         
+    except sqlite3.IntegrityError:
+        return jsonify({'success': False, 'error': 'Door name already exists'}), 409
     except Exception as e:
-        print(f"❌ ESP command error: {e}")
-        return jsonify({'has_command': False, 'error': str(e)})
+        print(f"❌ Door admin error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# ESP8266 status confirmation endpoint
-@app.route('/api/esp8266/confirm', methods=['POST'])
-def confirm_command():
+# Door access-control endpoint
+@app.route('/api/admin/acl', methods=['GET', 'POST'])
+def admin_acl():
+    """List door permissions, or grant/revoke one or many"""
     try:
-        data = request.get_json()
-        command_id = data.get('command_id')
-        success = data.get('success', False)
-        message = data.get('message', '')
+        admin, error = require_admin()
+        if error:
+            return error
         
-        if command_id in app.esp_commands:
-            if success:
-                print(f"✅ ESP8266 executed command {command_id}: {message}")
-                del app.esp_commands[command_id]
-            else:
-                print(f"❌ ESP8266 failed command {command_id}: {message}")
+        data = (request.get_json() or {}) if request.method == 'POST' else {}
         
-        return jsonify({'success': True})
+        conn = get_db_connection()
+        try:
+            if request.method == 'POST':
+                action = data.get('action')
+                if action not in ('grant', 'revoke'):
+                    return jsonify({'success': False, 'error': "action must be 'grant' or 'revoke'"}), 400
+                
+                # Either a single entry at the top level or a list under 'permissions'
+                items = data['permissions'] if 'permissions' in data else [data]
+                try:
+                    changes = parse_acl_changes(conn, action, items)
+                except LookupError as e:
+                    return jsonify({'success': False, 'error': e.args[0]}), 404
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                
+                with conn:
+                    acl_version = database.get_data_version(conn, 'acl')
+                    if action == 'grant':
+                        cursor = conn.executemany('''
+                            INSERT INTO door_permissions (user_id, door_id, days, start_minute, end_minute)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', [(user_id, door_id, days, start, end)
+                              for user_id, _, door_id, days, start, end in changes])
+                    else:
+                        cursor = conn.executemany(
+                            'DELETE FROM door_permissions WHERE user_id = ? AND door_id = ?',
+                            [(user_id, door_id) for user_id, _, door_id, *_ in changes]
+                        )
+                    database.bump_data_version(conn, 'acl')
+                
+                pairs = {(user_id, door_id) for user_id, _, door_id, *_ in changes}
+                def apply(index):
+                    if len(pairs) > ACL_REFRESH_PAIR_LIMIT:
+                        index.load(conn)
+                        return
+                    for user_id, door_id in pairs:
+                        index.refresh_permissions(conn, user_id, door_id)
+                update_acl_index(acl_version, apply)
+                print(f"🔑 ACL {action} of {len(changes)} entries by {admin}")
+                
+                # Only echo what changed; GET lists the whole table
+                result = {'success': True, 'action': action, 'affected': cursor.rowcount}
+                if action == 'grant':
+                    result['permissions'] = [{
+                        'user': username,
+                        'door_id': door_id,
+                        'days': [day for day in range(7) if days & (1 << day)],
+                        'start_time': acl.format_time(start),
+                        'end_time': acl.format_time(end)
+                    } for _, username, door_id, days, start, end in changes]
+                return jsonify(result)
+            
+            permissions = [{
+                'id': row['id'],
+                'user': row['username'],
+                'door_id': row['door_id'],
+                'days': [day for day in range(7) if row['days'] & (1 << day)],
+                'start_time': acl.format_time(row['start_minute']),
+                'end_time': acl.format_time(row['end_minute'])
+            } for row in conn.execute('''
+                SELECT p.id, u.username, p.door_id, p.days, p.start_minute, p.end_minute
+                FROM door_permissions p JOIN users u ON u.id = p.user_id
+                ORDER BY p.door_id, u.username
+            ''')]
+        finally:
+            conn.close()
+        
+        return jsonify({'success': True, 'permissions': permissions})
         
     except Exception as e:
-        print(f"❌ ESP confirm error: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+        print(f"❌ ACL admin error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# ESP8266 debug endpoint
-@app.route('/api/esp8266/debug', methods=['GET'])
-def esp_debug():
-    """Check ESP8266 connection status"""
+# Access anomaly detection endpoint
+@app.route('/api/admin/anomalies', methods=['GET', 'POST'])
+def admin_anomalies():
+    """List flagged access anomalies, or scan new access logs for more"""
     try:
-        active_commands = []
-        recent_commands = []
+        admin, error = require_admin()
+        if error:
+            return error
         
-        current_time = time.time()
-        for cmd_id, cmd in app.esp_commands.items():
-            if not cmd['executed'] and current_time - cmd['timestamp'] < 60:
-                active_commands.append(cmd_id)
+        conn = get_db_connection()
+        try:
+            if request.method == 'POST':
+                full = (request.get_json(silent=True) or {}).get('full', False)
+                if not isinstance(full, bool):
+                    return jsonify({'success': False, 'error': 'full must be true or false'}), 400
+                new_events = app.anomaly_detector.run(conn, full=full)
+                if new_events:
+                    print(f"🚨 {len(new_events)} new access anomalies flagged")
+                return jsonify({'success': True, 'new_events': new_events, **anomaly.status(conn)})
             
-            recent_commands.append({
-                'command_id': cmd_id,
-                'command': cmd['command'],
-                'relay_pin': cmd['relay_pin'],
-                'timestamp': cmd['timestamp'],
-                'executed': cmd['executed']
+            try:
+                since_id = int(request.args.get('since_id', 0))
+            except ValueError:
+                return jsonify({'success': False, 'error': 'since_id must be an integer'}), 400
+            return jsonify({
+                'success': True,
+                'flagged': anomaly.flagged_events(conn, since_id),
+                **anomaly.status(conn)
             })
-        
-        recent_commands.sort(key=lambda x: x['timestamp'], reverse=True)
-        recent_commands = recent_commands[:5]
-        
-        return jsonify({
-            'success': True,
-            'pending_commands': len(app.esp_commands),
-            'active_commands': active_commands,
-            'recent_commands': recent_commands,
-            'total_commands_stored': len(app.esp_commands)
-        })
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-# ESP8266 test command endpoint
-@app.route('/api/esp8266/test-command', methods=['POST'])
-def test_esp_command():
-    """Send a test command to ESP8266"""
-    try:
-        command_id = set_esp_command("activate", relay_pin=1, duration=5000)
-        
-        return jsonify({
-            'success': True,
-            'message': 'Test command sent to ESP8266',
-            'command_id': command_id,
-            'command': 'activate relay for 5 seconds',
-            'relay_pin': 1,
-            'duration': 5000
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-# ESP8266 status endpoint
-@app.route('/api/esp8266/status', methods=['POST'])
-def esp_status():
-    """Receive status updates from ESP8266"""
-    try:
-        data = request.get_json()
-        status = data.get('status', 'unknown')
-        message = data.get('message', '')
-        ip_address = data.get('ip_address', '')
-        
-        print(f"📡 ESP8266 Status Update:")
-        print(f"   Status: {status}")
-        print(f"   Message: {message}")
-        print(f"   IP Address: {ip_address}")
-        
-        return jsonify({'success': True, 'message': 'Status received'})
+        finally:
+            conn.close()
         
     except Exception as e:
-        print(f"❌ ESP status error: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+        print(f"❌ Anomaly detection error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# Access logs route
-@app.route('/api/access-logs', methods=['GET'])
-def get_access_logs():
-    try:
-        conn = get_db_connection()
-        logs = conn.execute('''
-            SELECT * FROM access_logs 
-            ORDER BY access_time DESC 
-            LIMIT 20
-        ''').fetchall()
-        conn.close()
-        
-        logs_list = [{
-            'id': log['id'],
-            'username': log['username'],
-            'access_time': log['access_time'],
-            'status': log['status'],
-            'action': log['action']
-        } for log in logs]
-        
-        return jsonify({'success': True, 'logs': logs_list})
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': 'Server error','exception':str(e)}), 500
+# Hourly access-log retention, run by one process per host
+retention.start_retention_worker(get_db_connection, DATABASE + '.retention.lock')
 
-if __name__ == '_main_':
-    init_db()
+if __name__ == '__main__':
     print_network_info()
     
     print("\n🚀 Starting Smart Door Lock Server on port 5000...")
@@ -771,5 +860,15 @@ if __name__ == '_main_':
     print("   POST /api/unlock-door")
     print("   POST /api/lock-door")
     print("   GET  /api/access-logs")
+    print("   GET  /api/admin/profiling")
+    print("   POST /api/admin/profiling")
+    print("   POST /api/admin/retention")
+    print("   POST /api/admin/users/import")
+    print("   GET  /api/admin/doors")
+    print("   POST /api/admin/doors")
+    print("   GET  /api/admin/acl")
+    print("   POST /api/admin/acl")
+    print("   GET  /api/admin/anomalies")
+    print("   POST /api/admin/anomalies")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1 @@
+# Lets plain `pytest` import the top-level modules (app, anomaly, ...) from tests/
@@ -1,11 +1,26 @@
+import secrets
 import sqlite3
 
-def init_database():
-    conn = sqlite3.connect('smart_door_lock.db')
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
+DATABASE = 'smart_door_lock.db'
+
+# Accounts seeded on a fresh database (union of the lists previously
+# seeded by app.init_db and database.init_database)
+DEFAULT_USERS = [
+    ('admin', 'admin123', 'admin'),
+    ('Himani', 'Himani123', 'user'),
+    ('user1', 'user123', 'user'),
+    ('user2', 'user123', 'user'),
+    ('user3', 'user123', 'user'),
+    ('user4', 'user123', 'user')
+]
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def create_base_schema(conn):
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
@@ -15,34 +30,212 @@ def init_database():
         )
     ''')
     
-    # Create access logs table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS access_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT NOT NULL,
             access_time DATETIME DEFAULT CURRENT_TIMESTAMP,
             status TEXT NOT NULL,
+            action TEXT,
             photo_url TEXT
         )
     ''')
+
+
+def unify_access_logs(conn):
+    # Older databases have either `action` (app.init_db) or `photo_url`
+    # (database.init_database); bring both up to the shared schema
+    columns = table_columns(conn, 'access_logs')
+    if 'action' not in columns:
+        conn.execute('ALTER TABLE access_logs ADD COLUMN action TEXT')
+    if 'photo_url' not in columns:
+        conn.execute('ALTER TABLE access_logs ADD COLUMN photo_url TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_access_logs_access_time ON access_logs (access_time)')
+
+
+def add_user_disabled_flag(conn):
+    if 'disabled' not in table_columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN disabled INTEGER NOT NULL DEFAULT 0')
+
+
+def seed_default_users(conn):
+    # Only a brand-new database gets the default accounts; upgrades must
+    # never add logins with well-known passwords
+    if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+        return
+    conn.executemany(
+        'INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
+        DEFAULT_USERS
+    )
+
+
+def create_door_acl(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS doors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            relay_pin INTEGER NOT NULL
+        )
+    ''')
     
-    # Insert default data
-    users = [
-        ('admin', 'admin123', 'admin'),
-        ('user1', 'user123', 'user'),
-        ('user2', 'user123', 'user'),
-        ('user3', 'user123', 'user'),
-        ('user4', 'user123', 'user')
-    ]
+    # days is a weekday bitmask (Monday = bit 0); start/end are minutes
+    # since midnight, NULL meaning the whole day
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS door_permissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            door_id INTEGER NOT NULL REFERENCES doors (id),
+            days INTEGER NOT NULL DEFAULT 127,
+            start_minute INTEGER,
+            end_minute INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_door_permissions_user_door ON door_permissions (user_id, door_id)')
     
-    cursor.executemany(
-        'INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
-        users
+    # Keep the single-relay behaviour: everyone may open the existing door
+    conn.execute("INSERT OR IGNORE INTO doors (id, name, relay_pin) VALUES (1, 'Main door', 1)")
+    conn.execute("INSERT INTO door_permissions (user_id, door_id) SELECT id, 1 FROM users WHERE role != 'admin'")
+
+
+def create_data_versions(conn):
+    # Counters bumped by writes so every process can tell when its
+    # in-memory copy of some data is stale
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def create_app_settings(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    # Shared by all worker processes to sign login tokens
+    conn.execute(
+        "INSERT OR IGNORE INTO app_settings (name, value) VALUES ('secret_key', ?)",
+        (secrets.token_hex(32),)
     )
+
+
+def create_anomaly_tables(conn):
+    # Detector progress shared by all worker processes; generation is
+    # bumped on every save so concurrent runs can detect each other
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anomaly_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL DEFAULT 0,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            rows_processed INTEGER NOT NULL DEFAULT 0,
+            usernames TEXT NOT NULL DEFAULT '[]',
+            hour_counts BLOB,
+            recent_timestamps BLOB,
+            recent_users BLOB,
+            recent_failed BLOB
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO anomaly_state (id) VALUES (1)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS access_anomalies (
+            log_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            username TEXT NOT NULL,
+            access_time TEXT NOT NULL,
+            detail TEXT NOT NULL,
+            PRIMARY KEY (log_id, type)
+        )
+    ''')
+
+
+# Ordered schema migrations; PRAGMA user_version records the last applied one
+MIGRATIONS = [
+    (1, 'create base schema', create_base_schema),
+    (2, 'unify access_logs columns', unify_access_logs),
+    (3, 'seed default users', seed_default_users),
+    (4, 'add users.disabled flag', add_user_disabled_flag),
+    (5, 'create door access-control tables', create_door_acl),
+    (6, 'create data_versions table', create_data_versions),
+    (7, 'create app_settings with token secret', create_app_settings),
+    (8, 'create anomaly detection state', create_anomaly_tables),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_setting(conn, name):
+    row = conn.execute('SELECT value FROM app_settings WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_setting(conn, name, value):
+    """Insert or replace a shared setting; call inside the writing transaction"""
+    conn.execute('''
+        INSERT INTO app_settings (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    ''', (name, value))
+
+
+def get_data_version(conn, name):
+    row = conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(conn, name):
+    """Increment a shared data version; call inside the writing transaction"""
+    conn.execute('''
+        INSERT INTO data_versions (name, version) VALUES (?, 1)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1
+    ''', (name,))
+
+
+def migrate(conn):
+    """Apply pending migrations in one transaction; returns the versions applied"""
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        return []
+    
+    # A brand-new file can still choose its vacuum mode; enable incremental
+    # vacuum so access-log retention can reclaim space in small steps
+    if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Re-read under the write lock in case another process migrated first
+        current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+        applied = []
+        for version, description, apply in MIGRATIONS:
+            if version <= current_version:
+                continue
+            apply(conn)
+            applied.append(version)
+            print(f"🔧 Applied migration {version}: {description}")
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.execute('COMMIT')
+        return applied
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def init_database(path=DATABASE):
+    conn = sqlite3.connect(path)
+    try:
+        applied = migrate(conn)
+    finally:
+        conn.close()
     
-    conn.commit()
-    conn.close()
+    if applied:
+        print(f"Database migrated to schema version {SCHEMA_VERSION}")
     print("Database initialized successfully!")
+    return applied
 
 if __name__ == '__main__':
     init_database()
\ No newline at end of file
@@ -0,0 +1,393 @@
+import cProfile
+import collections
+import itertools
+import json
+import os
+import random
+import signal
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+
+import database
+
+# Profiling configuration, adjustable at runtime via /api/admin/profiling.
+# Everything but output_dir is stored in app_settings so that all worker
+# processes follow the same settings.
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'mode': 'cprofile',          # 'cprofile' or 'sampler'
+    'sample_rate': 0.1,          # fraction of requests to profile
+    'slow_threshold_ms': 500,    # requests slower than this are captured
+    'sampler_interval_ms': 5,    # stack sampling interval for 'sampler' mode
+    'output_dir': 'profiles',
+}
+SHARED_SETTINGS = ('enabled', 'mode', 'sample_rate', 'slow_threshold_ms', 'sampler_interval_ms')
+SETTINGS_NAME = 'profiling'
+SETTINGS_CHECK_INTERVAL_SECONDS = 1.0
+SLOW_REQUESTS_FILE = 'slow_requests.jsonl'
+PROFILE_EXTENSIONS = ('.prof', '.folded')
+MAX_SLOW_REQUESTS = 50
+MAX_SQL_PER_REQUEST = 200
+MAX_PROFILE_FILES = 200                  # oldest profiles beyond this are deleted
+MAX_SLOW_LOG_BYTES = 5 * 1024 * 1024     # slow_requests.jsonl is rotated to .1 beyond this
+
+# Makes profile file names unique within this process
+_capture_ids = itertools.count(1)
+
+
+class StackSampler:
+    """Low-overhead sampler that records collapsed stacks of one thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """Write stacks in the collapsed format used by flamegraph.pl / speedscope"""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection that times every statement into the request's SQL log"""
+
+    sql_log = None
+    started = 0.0
+
+    def _timed(self, statement, run):
+        begin = time.perf_counter()
+        try:
+            return run()
+        finally:
+            end = time.perf_counter()
+            if len(self.sql_log) < MAX_SQL_PER_REQUEST:
+                self.sql_log.append({
+                    'statement': statement,
+                    'at_ms': round((begin - self.started) * 1000, 3),
+                    'duration_ms': round((end - begin) * 1000, 3)
+                })
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sql, lambda: sqlite3.Connection.execute(self, sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sql, lambda: sqlite3.Connection.executemany(self, sql, seq_of_parameters))
+
+    def commit(self):
+        return self._timed('COMMIT', lambda: sqlite3.Connection.commit(self))
+
+    def rollback(self):
+        return self._timed('ROLLBACK', lambda: sqlite3.Connection.rollback(self))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 'with conn:' commits or rolls back in C without calling commit()
+        statement = 'ROLLBACK' if exc_type else 'COMMIT'
+        return self._timed(statement, lambda: sqlite3.Connection.__exit__(self, exc_type, exc_value, traceback))
+
+
+def init_profiling(app, get_connection, toggle_signal=None):
+    """Register request hooks on the Flask app.
+
+    get_connection opens a connection to the database holding the shared
+    settings. toggle_signal (a name such as 'SIGRTMIN') optionally installs
+    a signal handler that flips profiling on and off for every worker. It
+    is opt-in because gunicorn workers already use HUP, USR1, USR2, WINCH,
+    TTIN and TTOU.
+    """
+    app.profiling = {
+        'settings': dict(DEFAULT_SETTINGS),
+        'get_connection': get_connection,
+        'checked_at': None,
+    }
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+
+    if toggle_signal:
+        signum = getattr(signal, toggle_signal, None)
+        if signum is None:
+            print(f"⚠️ Unknown profiling toggle signal: {toggle_signal}")
+            return
+        try:
+            # Writing to the database is not safe inside a signal handler
+            signal.signal(signum, lambda signum, frame: threading.Thread(
+                target=toggle_profiling, args=(app,), daemon=True
+            ).start())
+        except ValueError:
+            # signal handlers can only be installed from the main thread
+            pass
+
+
+def _read_settings(conn):
+    settings = {}
+    value = database.get_setting(conn, SETTINGS_NAME)
+    if value:
+        stored = json.loads(value)
+        settings.update((key, stored[key]) for key in SHARED_SETTINGS if key in stored)
+    return settings
+
+
+def current_settings(app):
+    """This process's copy of the shared settings, re-read at most once per interval"""
+    profiling = app.profiling
+    now = time.monotonic()
+    if profiling['checked_at'] is None or now - profiling['checked_at'] >= SETTINGS_CHECK_INTERVAL_SECONDS:
+        profiling['checked_at'] = now
+        try:
+            conn = profiling['get_connection']()
+            try:
+                profiling['settings'] = dict(DEFAULT_SETTINGS, **_read_settings(conn))
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            print(f"❌ Could not load profiling settings: {e}")
+    return profiling['settings']
+
+
+def _change_settings(app, change):
+    """Apply change(settings) -> error message or None to the shared settings"""
+    profiling = app.profiling
+    conn = profiling['get_connection']()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            settings = dict(DEFAULT_SETTINGS, **_read_settings(conn))
+            error = change(settings)
+            if error:
+                conn.rollback()
+                return error
+            database.set_setting(conn, SETTINGS_NAME, json.dumps({key: settings[key] for key in SHARED_SETTINGS}))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    profiling['settings'] = settings
+    profiling['checked_at'] = time.monotonic()
+    return None
+
+
+def toggle_profiling(app):
+    def toggle(settings):
+        settings['enabled'] = not settings['enabled']
+    try:
+        _change_settings(app, toggle)
+        print(f"🩺 Profiling {'enabled' if app.profiling['settings']['enabled'] else 'disabled'}")
+    except sqlite3.Error as e:
+        print(f"❌ Could not toggle profiling: {e}")
+
+
+def update_settings(app, data):
+    """Apply settings from an admin request, returning an error message if invalid"""
+    def change(settings):
+        if 'enabled' in data:
+            if not isinstance(data['enabled'], bool):
+                return 'enabled must be true or false'
+            settings['enabled'] = data['enabled']
+        if 'mode' in data:
+            if data['mode'] not in ('cprofile', 'sampler'):
+                return "mode must be 'cprofile' or 'sampler'"
+            settings['mode'] = data['mode']
+        try:
+            for key in ('sample_rate', 'slow_threshold_ms', 'sampler_interval_ms'):
+                if key in data:
+                    if isinstance(data[key], bool):
+                        raise TypeError(key)
+                    settings[key] = float(data[key])
+        except (TypeError, ValueError):
+            return 'numeric settings must be numbers'
+        if not 0 <= settings['sample_rate'] <= 1:
+            return 'sample_rate must be between 0 and 1'
+        if settings['sampler_interval_ms'] <= 0:
+            return 'sampler_interval_ms must be positive'
+        if settings['slow_threshold_ms'] < 0:
+            return 'slow_threshold_ms must not be negative'
+        return None
+
+    return _change_settings(app, change)
+
+
+def _tail_lines(path, count, block_size=65536):
+    """Last count lines of a file, reading backwards from the end"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b''
+            while position > 0 and data.count(b'\n') <= count:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+    except FileNotFoundError:
+        return []
+    return data.splitlines()[-count:]
+
+
+def summary(app):
+    """Settings and recent captures, as seen by every worker process"""
+    output_dir = app.profiling['settings']['output_dir']
+    path = os.path.join(output_dir, SLOW_REQUESTS_FILE)
+    lines = _tail_lines(path, MAX_SLOW_REQUESTS)
+    if len(lines) < MAX_SLOW_REQUESTS:
+        lines = _tail_lines(path + '.1', MAX_SLOW_REQUESTS - len(lines)) + lines
+    slow_requests = []
+    for line in lines:
+        try:
+            slow_requests.append(json.loads(line))
+        except ValueError:
+            # a line still being appended by another worker
+            continue
+    try:
+        profile_files = sum(1 for name in os.listdir(output_dir) if name.endswith(PROFILE_EXTENSIONS))
+    except FileNotFoundError:
+        profile_files = 0
+    return {
+        'settings': current_settings(app),
+        'profile_files': profile_files,
+        'slow_requests': slow_requests
+    }
+
+
+def connect(database):
+    """sqlite3.connect that times statements while a request capture is active"""
+    if has_request_context() and g.get('profiling_sql') is not None:
+        conn = sqlite3.connect(database, factory=ProfiledConnection)
+        conn.sql_log = g.profiling_sql
+        conn.started = g.profiling_started
+        return conn
+    return sqlite3.connect(database)
+
+
+def _start_request():
+    settings = current_settings(current_app)
+    if not settings['enabled']:
+        return
+
+    g.profiling_started = time.perf_counter()
+    g.profiling_sql = []
+    g.profiler = None
+
+    if random.random() < settings['sample_rate']:
+        if settings['mode'] == 'sampler':
+            g.profiler = StackSampler(threading.get_ident(), settings['sampler_interval_ms'] / 1000)
+            g.profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                # another profiler is already active (e.g. concurrent request)
+                pass
+
+
+def _prune_profiles(output_dir):
+    """Delete the oldest profile files beyond MAX_PROFILE_FILES"""
+    profiles = []
+    for entry in os.scandir(output_dir):
+        if entry.name.endswith(PROFILE_EXTENSIONS):
+            try:
+                profiles.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+    if len(profiles) <= MAX_PROFILE_FILES:
+        return
+    profiles.sort()
+    for _, path in profiles[:len(profiles) - MAX_PROFILE_FILES]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # already pruned by another worker
+            pass
+
+
+def _append_slow_request(path, entry):
+    """Append to the slow-request log, rotating it to .1 once it grows too big"""
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+        size = f.tell()
+        inode = os.fstat(f.fileno()).st_ino
+    if size > MAX_SLOW_LOG_BYTES:
+        try:
+            # skip if another worker has already rotated it
+            if os.stat(path).st_ino == inode:
+                os.replace(path, path + '.1')
+        except FileNotFoundError:
+            pass
+
+
+def _finish_request(exc):
+    if g.get('profiling_sql') is None:
+        return
+
+    settings = current_app.profiling['settings']
+    duration_ms = (time.perf_counter() - g.profiling_started) * 1000
+
+    profiler = g.profiler
+    if profiler is not None:
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    is_slow = duration_ms >= settings['slow_threshold_ms']
+    if profiler is None and not is_slow:
+        return
+
+    try:
+        os.makedirs(settings['output_dir'], exist_ok=True)
+        stamp = f"{int(time.time() * 1000)}_{os.getpid()}_{next(_capture_ids)}_{request.endpoint or 'unknown'}"
+        profile_file = None
+
+        if profiler is not None:
+            extension = 'folded' if isinstance(profiler, StackSampler) else 'prof'
+            profile_file = os.path.join(settings['output_dir'], f"{stamp}.{extension}")
+            if isinstance(profiler, StackSampler):
+                profiler.dump(profile_file)
+            else:
+                profiler.dump_stats(profile_file)
+            _prune_profiles(settings['output_dir'])
+
+        if is_slow:
+            entry = {
+                'route': request.url_rule.rule if request.url_rule else request.path,
+                'method': request.method,
+                'path': request.full_path,
+                'duration_ms': round(duration_ms, 3),
+                'timestamp': time.time(),
+                'error': str(exc) if exc else None,
+                'sql': g.profiling_sql,
+                'profile_file': profile_file
+            }
+            _append_slow_request(os.path.join(settings['output_dir'], SLOW_REQUESTS_FILE), entry)
+            print(f"🐢 Slow request: {entry['method']} {entry['route']} took {entry['duration_ms']}ms")
+    except Exception as e:
+        print(f"❌ Profiling error: {e}")
@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import time
+
+from flask import Response, current_app, request
+
+# Responses are cached per namespace and discarded when the namespace
+# version changes. The version is either an in-process counter bumped by
+# writes (ESP command queue) or supplied by the caller from shared state
+# such as the database, so writes in other processes are seen too.
+MAX_ENTRIES_PER_NAMESPACE = 64
+
+_lock = threading.Lock()
+_versions = {}
+_entries = {}
+
+
+def bump(namespace):
+    """Invalidate every cached response in namespace"""
+    with _lock:
+        _versions[namespace] = _versions.get(namespace, 0) + 1
+        _entries.pop(namespace, None)
+
+
+def cached_response(namespace, builder, key=None, version=None):
+    """Serve a pre-serialized JSON response, building it only on a cache miss.
+
+    builder() returns (payload, expires_at); expires_at is a time.time()
+    deadline for responses that also change with the clock, or None.
+    The key defaults to the request's query parameters. Pass version when
+    the data is shared with other processes; otherwise the in-process
+    counter maintained by bump() is used.
+    """
+    if key is None:
+        key = tuple(sorted(request.args.items(multi=True)))
+
+    now = time.time()
+    with _lock:
+        local_version = _versions.get(namespace, 0)
+        current_version = (local_version, version)
+        entry = _entries.get(namespace, {}).get(key)
+    if (entry is None or entry['version'] != current_version
+            or (entry['expires_at'] is not None and now >= entry['expires_at'])):
+        payload, expires_at = builder()
+        body = current_app.json.dumps(payload).encode('utf-8')
+        entry = {
+            'body': body,
+            'etag': f"{namespace}-{hashlib.md5(body).hexdigest()}",
+            'version': current_version,
+            'expires_at': expires_at
+        }
+        with _lock:
+            # Only store if no local write happened while the response was built
+            if _versions.get(namespace, 0) == local_version:
+                namespace_entries = _entries.setdefault(namespace, {})
+                if len(namespace_entries) >= MAX_ENTRIES_PER_NAMESPACE:
+                    namespace_entries.pop(next(iter(namespace_entries)))
+                namespace_entries[key] = entry
+
+    if entry['etag'] in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,250 @@
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+import database
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process dev server runs there
+    fcntl = None
+
+# Access-log retention: rows older than RETENTION_DAYS are moved into
+# gzip-compressed JSON-lines archives. Every batch gets its own file,
+# grouped by month through the file name, and is written atomically.
+RETENTION_DAYS = 90
+ARCHIVE_DIR = 'archives'
+ARCHIVE_BATCH_SIZE = 500
+VACUUM_STEP_PAGES = 200
+STEP_PAUSE_SECONDS = 0.05
+AUTO_VACUUM_INCREMENTAL = 2
+WORKER_START_DELAY_SECONDS = 60
+
+
+ARCHIVE_PREFIX = 'access_logs_'
+
+# Held while a run is in progress in this process
+_run_lock = threading.Lock()
+
+
+def archive_path(month, first_id, last_id, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{ARCHIVE_PREFIX}{month}_{first_id:010d}-{last_id:010d}.jsonl.gz")
+
+
+def write_archive(path, rows):
+    """Write rows to a temporary file and move it into place, so a crash
+    never leaves a partially written archive under its final name"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+    os.replace(temp_path, path)
+
+
+def archive_old_logs(get_connection, retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR):
+    """Move expired access_logs rows into monthly archives in small batches"""
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = 0
+
+    while True:
+        conn = get_connection()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM access_logs WHERE access_time < datetime('now', ?) ORDER BY id LIMIT ?",
+                (f'-{int(retention_days)} days', ARCHIVE_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(str(row['access_time'])[:7], []).append(dict(row))
+
+            # Archive first, then delete: a crash in between only leaves
+            # duplicates, which readers drop by id
+            for month, month_rows in by_month.items():
+                path = archive_path(month, month_rows[0]['id'], month_rows[-1]['id'], archive_dir)
+                write_archive(path, month_rows)
+
+            conn.executemany('DELETE FROM access_logs WHERE id = ?', [(row['id'],) for row in rows])
+            # Tell response caches in every process that rows disappeared
+            database.bump_data_version(conn, 'access_logs')
+            conn.commit()
+            archived += len(rows)
+        finally:
+            conn.close()
+
+        time.sleep(STEP_PAUSE_SECONDS)
+
+    return archived
+
+
+def enable_incremental_vacuum(get_connection):
+    """Switch the database to incremental auto-vacuum.
+
+    This runs a full VACUUM, which locks the database for its whole
+    duration. It is a one-off maintenance step for databases created
+    before migrations enabled incremental vacuum: stop the server and run
+    `python retention.py enable-incremental-vacuum`.
+    """
+    conn = get_connection()
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            conn.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}')
+            conn.execute('VACUUM')
+            print("🧹 Database converted to incremental auto-vacuum")
+    finally:
+        conn.close()
+
+
+def uses_incremental_vacuum(get_connection):
+    conn = get_connection()
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    finally:
+        conn.close()
+
+
+def incremental_vacuum(get_connection, step_pages=VACUUM_STEP_PAGES):
+    """Reclaim free pages a few at a time so writers are never blocked for long.
+
+    Does nothing on databases that are not in incremental auto-vacuum mode
+    (see enable_incremental_vacuum).
+    """
+    reclaimed = 0
+    while True:
+        conn = get_connection()
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                return reclaimed
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if free_pages == 0:
+                return reclaimed
+            step = min(step_pages, free_pages)
+            conn.execute(f'PRAGMA incremental_vacuum({step})').fetchall()
+            conn.commit()
+            reclaimed += step
+        finally:
+            conn.close()
+
+        time.sleep(STEP_PAUSE_SECONDS)
+
+
+def run_retention(get_connection, retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR):
+    archived = archive_old_logs(get_connection, retention_days, archive_dir)
+    reclaimed = incremental_vacuum(get_connection)
+    print(f"🗄️ Retention run: {archived} logs archived, {reclaimed} pages reclaimed")
+    return {'archived': archived, 'reclaimed_pages': reclaimed}
+
+
+def start_retention_worker(get_connection, lock_path, interval_seconds=3600):
+    """Run retention periodically in a daemon thread.
+
+    Every gunicorn worker imports the app, so an exclusive lock on
+    lock_path makes sure only one process on the host runs the job.
+    Returns None when another process already holds it.
+    """
+    lock_file = None
+    if fcntl is not None:
+        lock_file = open(lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+
+    if not uses_incremental_vacuum(get_connection):
+        print("⚠️ auto_vacuum is not INCREMENTAL: retention will archive logs but not "
+              "shrink the database file. Convert once with the server stopped: "
+              "python retention.py enable-incremental-vacuum")
+
+    def worker():
+        # lock_file stays referenced (and locked) for the life of the thread
+        held_lock = lock_file
+        time.sleep(WORKER_START_DELAY_SECONDS)
+        while True:
+            try:
+                with _run_lock:
+                    run_retention(get_connection)
+            except Exception as e:
+                print(f"❌ Retention error: {e}")
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    return thread
+
+
+def start_background_run(get_connection, retention_days=RETENTION_DAYS):
+    """Start a retention run in a daemon thread.
+
+    Returns False when a run is already in progress in this process.
+    """
+    if not _run_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            run_retention(get_connection, retention_days)
+        except Exception as e:
+            print(f"❌ Retention error: {e}")
+        finally:
+            _run_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+
+def read_archive_file(path):
+    """Read one archive, keeping whatever precedes a damaged section"""
+    logs = []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    logs.append(json.loads(line))
+                except ValueError:
+                    print(f"⚠️ Skipping corrupt line in {path}")
+    except (OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+        # e.g. a member truncated by a crash in an older appended archive
+        print(f"⚠️ Skipping unreadable remainder of {path}: {e}")
+    return logs
+
+
+def read_archived_logs(limit, archive_dir=ARCHIVE_DIR):
+    """Return up to limit archived rows, newest first"""
+    paths_by_month = {}
+    for path in glob.glob(os.path.join(archive_dir, f'{ARCHIVE_PREFIX}*.jsonl.gz')):
+        month = os.path.basename(path)[len(ARCHIVE_PREFIX):][:7]
+        paths_by_month.setdefault(month, []).append(path)
+
+    logs = []
+    seen_ids = set()
+    for month in sorted(paths_by_month, reverse=True):
+        month_logs = []
+        for path in paths_by_month[month]:
+            month_logs.extend(read_archive_file(path))
+        month_logs.sort(key=lambda log: (log['access_time'], log['id']), reverse=True)
+        for log in month_logs:
+            if log['id'] in seen_ids:
+                continue
+            seen_ids.add(log['id'])
+            logs.append(log)
+            if len(logs) >= limit:
+                return logs
+    return logs
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['enable-incremental-vacuum']:
+        enable_incremental_vacuum(lambda: sqlite3.connect(database.DATABASE))
+    else:
+        print("Usage: python retention.py enable-incremental-vacuum")
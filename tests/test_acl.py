@@ -0,0 +1,39 @@
+import pytest
+
+import acl
+
+FRIDAY, SATURDAY = 4, 5
+
+
+@pytest.mark.parametrize('weekday, time, expected', [
+    (FRIDAY, '23:00', True),
+    (FRIDAY, '03:00', False),    # belongs to Thursday night's window
+    (SATURDAY, '03:00', True),   # tail of Friday night's window
+    (SATURDAY, '23:00', False),
+    (SATURDAY, '06:00', False),  # end is exclusive
+])
+def test_window_wrapping_midnight_belongs_to_start_day(weekday, time, expected):
+    window = (acl.days_mask([FRIDAY]), acl.parse_time('22:00'), acl.parse_time('06:00'))
+    assert acl.in_window(window, weekday, acl.parse_time(time)) is expected
+
+
+def test_sunday_night_window_wraps_into_monday():
+    window = (acl.days_mask([6]), acl.parse_time('22:00'), acl.parse_time('06:00'))
+    assert acl.in_window(window, 0, acl.parse_time('05:59'))
+
+
+def test_days_mask():
+    assert acl.days_mask(None) == acl.ALL_DAYS
+    assert acl.days_mask([0, 6]) == 0b1000001
+
+
+@pytest.mark.parametrize('days', [5, '1,2', [True], [7], [1.0]])
+def test_days_mask_rejects_invalid_values(days):
+    with pytest.raises(ValueError):
+        acl.days_mask(days)
+
+
+@pytest.mark.parametrize('value', ['8', '25:00', '12:60', 'noon', '1:2:3'])
+def test_parse_time_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        acl.parse_time(value)
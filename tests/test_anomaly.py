@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+
+import anomaly
+import database
+
+
+def make_rows():
+    rows = []
+    # 30 days of morning unlocks for two users, then one 03:00 unlock
+    for day in range(1, 31):
+        for user in ('alice', 'bob'):
+            rows.append((user, f'2026-01-{day:02d} 09:15:00', 'success', 'Unlocked'))
+    rows.append(('alice', '2026-01-30 03:10:00', 'success', 'Unlocked'))
+    # A user whose first odd unlock comes before enough history exists
+    rows.append(('carol', '2026-01-01 03:00:00', 'success', 'Unlocked'))
+    rows.extend(('carol', f'2026-01-{day:02d} 09:00:00', 'success', 'Unlocked') for day in range(2, 12))
+    # Failed-login burst, split so it straddles incremental runs
+    rows.extend(('admin', f'2026-01-31 12:00:{second:02d}', 'failed', 'Login') for second in range(0, 40, 5))
+    return rows
+
+
+def open_db(tmp_path):
+    path = str(tmp_path / 'logs.db')
+    database.init_database(path)
+    return sqlite3.connect(path)
+
+
+def summarize(events):
+    return [(event['id'], event['username'], event['type']) for event in events]
+
+
+def test_incremental_runs_match_full_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(anomaly, 'CHUNK_SIZE', 7)
+    conn = open_db(tmp_path)
+    rows = make_rows()
+
+    incremental = anomaly.AnomalyDetector()
+    incremental_events = []
+    for start in range(0, len(rows), 11):
+        conn.executemany(
+            'INSERT INTO access_logs (username, access_time, status, action) VALUES (?, ?, ?, ?)',
+            rows[start:start + 11]
+        )
+        conn.commit()
+        incremental_events.extend(incremental.run(conn))
+
+    full_events = anomaly.AnomalyDetector().run(conn, full=True)
+
+    assert summarize(incremental_events) == summarize(full_events)
+    flagged = {(username, kind) for _, username, kind in summarize(full_events)}
+    assert ('alice', 'odd_hour_unlock') in flagged
+    assert ('admin', 'failed_login_burst') in flagged
+    assert not any(username in ('bob', 'carol') for username, _ in flagged)
+
+
+@pytest.mark.parametrize('history, flagged', [(19, False), (20, True)])
+def test_unlock_is_scored_against_earlier_history_only(tmp_path, history, flagged):
+    conn = open_db(tmp_path)
+    rows = [('dave', f'2026-02-01 09:{minute:02d}:00', 'success', 'Unlocked') for minute in range(history)]
+    rows.append(('dave', '2026-02-20 03:00:00', 'success', 'Unlocked'))
+    conn.executemany(
+        'INSERT INTO access_logs (username, access_time, status, action) VALUES (?, ?, ?, ?)', rows
+    )
+    conn.commit()
+
+    # The 03:00 unlock neither counts towards its own history nor its own hour
+    events = anomaly.AnomalyDetector().run(conn)
+    assert [event['type'] for event in events] == (['odd_hour_unlock'] if flagged else [])
+
+
+def test_detectors_share_state_through_the_database(tmp_path):
+    conn = open_db(tmp_path)
+    rows = make_rows()
+
+    # Two workers taking turns pick up where the other left off
+    workers = [anomaly.AnomalyDetector(), anomaly.AnomalyDetector()]
+    events = []
+    for batch, start in enumerate(range(0, len(rows), 11)):
+        conn.executemany(
+            'INSERT INTO access_logs (username, access_time, status, action) VALUES (?, ?, ?, ?)',
+            rows[start:start + 11]
+        )
+        conn.commit()
+        events.extend(workers[batch % 2].run(conn))
+
+    assert summarize(events) == summarize(anomaly.AnomalyDetector().run(conn, full=True))
+    assert summarize(anomaly.flagged_events(conn)) == summarize(events)
+    assert anomaly.status(conn)['rows_processed'] == len(rows)
+
+
+def test_stale_run_is_not_saved(tmp_path):
+    conn = open_db(tmp_path)
+    conn.executemany(
+        'INSERT INTO access_logs (username, access_time, status, action) VALUES (?, ?, ?, ?)', make_rows()
+    )
+    conn.commit()
+
+    stale = anomaly.AnomalyDetector()
+    generation = stale._load(conn)
+    first = anomaly.AnomalyDetector().run(conn)
+    assert not stale._save(conn, generation, stale._scan(conn), full=False)
+    assert summarize(anomaly.flagged_events(conn)) == summarize(first)
@@ -0,0 +1,172 @@
+import csv
+
+import database
+
+VALID_ROLES = ('admin', 'user')
+IMPORT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 200
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+FALSE_VALUES = ('0', 'false', 'no', 'n')
+
+
+def parse_json_rows(users):
+    """Yield user dicts from a JSON list"""
+    for user in users:
+        yield user if isinstance(user, dict) else {'_error': 'row must be an object'}
+
+
+class ImportFormatError(ValueError):
+    """The upload as a whole cannot be parsed"""
+
+
+def parse_csv_rows(stream, encoding='utf-8-sig'):
+    """Yield user dicts from a CSV upload (header: username,password,role,disabled).
+
+    The header is read immediately so an unreadable file is rejected with
+    ImportFormatError before the import starts. Later lines that cannot be
+    decoded or parsed become error rows; every row carries its line number
+    in '_line'.
+    """
+    lines = iter(stream)
+    try:
+        header = next(lines, b'').decode(encoding)
+    except UnicodeDecodeError:
+        raise ImportFormatError(f'CSV header is not valid {encoding}')
+    try:
+        fieldnames = [name.strip() for name in next(csv.reader([header]), [])]
+    except csv.Error as e:
+        raise ImportFormatError(f'CSV header is malformed: {e}')
+    if 'username' not in fieldnames:
+        raise ImportFormatError('CSV header must include a username column')
+    return _csv_rows(lines, fieldnames, encoding)
+
+
+def _csv_rows(lines, fieldnames, encoding):
+    bad_lines = []
+    current_line = [1]
+
+    def decoded():
+        for line_number, line in enumerate(lines, start=2):
+            current_line[0] = line_number
+            try:
+                yield line.decode(encoding)
+            except UnicodeDecodeError:
+                bad_lines.append(line_number)
+                # a blank line, which DictReader skips
+                yield '\n'
+
+    reader = csv.DictReader(decoded(), fieldnames=fieldnames)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            row = None
+        except csv.Error as e:
+            row = {'_error': f'malformed CSV: {e}'}
+        # Report undecodable lines read so far, in order, before this row
+        for line_number in bad_lines:
+            yield {'_error': f'line is not valid {encoding}', '_line': line_number}
+        bad_lines.clear()
+        if row is None:
+            return
+        if '_error' not in row:
+            row = {key.strip(): value.strip() for key, value in row.items() if key and value is not None}
+        # the last line read, which csv.Error leaves out of reader.line_num
+        row['_line'] = current_line[0]
+        yield row
+
+
+def parse_disabled(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return 1
+    if text in FALSE_VALUES:
+        return 0
+    raise ValueError('disabled must be true or false')
+
+
+def normalize_row(row):
+    """Validate one row, returning (username, password, role, disabled)"""
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    username = str(row.get('username') or '').strip()
+    if not username:
+        raise ValueError('username is required')
+    password = row.get('password') or None
+    if password is not None:
+        password = str(password)
+    role = row.get('role') or None
+    if role is not None and role not in VALID_ROLES:
+        raise ValueError(f"role must be one of {', '.join(VALID_ROLES)}")
+    return username, password, role, parse_disabled(row.get('disabled'))
+
+
+def import_users(conn, rows):
+    """Create, update or disable users from rows in a single transaction.
+
+    Existing users get only the supplied fields updated; new users need
+    a password and role. Invalid rows are reported and skipped.
+    """
+    summary = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def fail(row_number, username, message):
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'row': row_number, 'username': username, 'error': message})
+
+    def flush(batch):
+        usernames = list({row[1][0] for row in batch})
+        placeholders = ','.join('?' * len(usernames))
+        known = {row[0] for row in conn.execute(
+            f'SELECT username FROM users WHERE username IN ({placeholders})', usernames
+        )}
+
+        inserts = []
+        updates = []
+        for row_number, (username, password, role, disabled) in batch:
+            if username in known:
+                updates.append((password, role, disabled, username))
+            elif password is None or role is None:
+                fail(row_number, username, 'new users need a password and role')
+            else:
+                inserts.append((username, password, role, disabled or 0))
+                known.add(username)
+
+        # Insert first so later rows in the batch can update new users
+        conn.executemany(
+            'INSERT INTO users (username, password, role, disabled) VALUES (?, ?, ?, ?)',
+            inserts
+        )
+        conn.executemany('''
+            UPDATE users SET
+                password = COALESCE(?, password),
+                role = COALESCE(?, role),
+                disabled = COALESCE(?, disabled)
+            WHERE username = ?
+        ''', updates)
+        summary['created'] += len(inserts)
+        summary['updated'] += len(updates)
+
+    batch = []
+    with conn:
+        for position, row in enumerate(rows, start=1):
+            # CSV rows are numbered by their line in the file
+            row_number = row.get('_line', position)
+            try:
+                batch.append((row_number, normalize_row(row)))
+            except ValueError as e:
+                fail(row_number, row.get('username') if isinstance(row, dict) else None, str(e))
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        database.bump_data_version(conn, 'users')
+
+    summary['errors'].sort(key=lambda error: error['row'])
+    return summary